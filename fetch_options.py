@@ -1,5 +1,7 @@
 from __future__ import annotations
+import re
 from abc import abstractmethod, ABC
+from urllib.parse import quote
 from utils import get_json
 from html.parser import HTMLParser
 
@@ -28,6 +30,7 @@ class TootFilter(Filter):
     """
     Gives several filter options for toot fetch. To change options, edit ./search/toot_filter.json.
     """
+    public_timeline = "/api/v1/timelines/public"
 
     def __init__(self, toot_filter_link: str = "search/toot_filter.json"):
         """
@@ -43,6 +46,9 @@ class TootFilter(Filter):
         toot_filter = get_json(toot_filter_link, default_toot_filter)
         self.substring = toot_filter["substring"]
         self.languages = toot_filter["languages"]
+        # Optional, so that filter files without the tag filters still work.
+        self.tags_any = self._normalize_tags(toot_filter.get("tags_any"))
+        self.tags_all = self._normalize_tags(toot_filter.get("tags_all"))
         self.has_image = toot_filter["has_image"]
         self.has_video = toot_filter["has_video"]
         self.has_media = toot_filter["has_media"]
@@ -50,6 +56,13 @@ class TootFilter(Filter):
         if self.has_video or self.has_image:
             self.has_media = True
 
+    def _normalize_tags(self, tags: list[str] | None) -> list[str]:
+        """
+        Returns the tags in lower case without leading '#'. Empty tags are dropped.
+        """
+        tags = [tag.strip().lstrip("#").lower() for tag in tags or []]
+        return [tag for tag in tags if tag != ""]
+
     def filter(self, toots: list) -> list:
         result = []
         for toot in toots:
@@ -63,6 +76,12 @@ class TootFilter(Filter):
                 continue
             if self.languages and toot["language"] not in self.languages:
                 continue
+            if self.tags_any or self.tags_all:
+                toot_tags = {tag["name"].lower() for tag in toot["tags"]}
+                if self.tags_any and toot_tags.isdisjoint(self.tags_any):
+                    continue
+                if not toot_tags.issuperset(self.tags_all):
+                    continue
             if self.has_image is not None:
                 image_in_toots = "image" in [media["type"] for media in toot["media_attachments"]]
                 if self.has_image != image_in_toots:
@@ -83,6 +102,37 @@ class TootFilter(Filter):
 
         return params
 
+    def _supports_tag_params(self, instance_info: dict) -> bool:
+        """
+        Returns true if the tag timeline of the instance supports the any[] and all[] params (Mastodon 2.7.0).
+        """
+        match = re.match(r"(\d+)\.(\d+)", instance_info.get("version") or "")
+        return match is not None and (int(match[1]), int(match[2])) >= (2, 7)
+
+    def plan(self, instance_info: dict) -> tuple[str, dict]:
+        """
+        Chooses the timeline of an instance that returns the fewest toots which are filtered out afterwards.
+        Tag filters are pushed to the tag timeline. Falls back to the public timeline.
+        :param dict instance_info: Response of /api/v1/instance. Empty dict if not available.
+        :return: Path of the timeline and the params for the fetch.
+        """
+        params = self.params()
+        if not self.tags_any and not self.tags_all:
+            return self.public_timeline, params
+
+        # The any[] param widens the timeline (tag OR any), the all[] param narrows it (tag AND all).
+        # If tags_all is given, the timeline of its first tag already contains every toot that can pass the filters.
+        if self.tags_all:
+            tag, *tags_all = self.tags_all
+            if tags_all and self._supports_tag_params(instance_info): params |= {"all[]": tags_all}
+        else:
+            tag, *tags_any = self.tags_any
+            if tags_any and not self._supports_tag_params(instance_info):
+                return self.public_timeline, params
+            if tags_any: params |= {"any[]": tags_any}
+
+        return "/api/v1/timelines/tag/" + quote(tag, safe=""), params
+
 
 class TootAttributes:
     """
@@ -0,0 +1,81 @@
+import sys
+import time
+
+
+class FetchProgress:
+    """
+    Counts fetched pages and toots, enforces the fetch budgets and prints a live progress line.
+    """
+
+    def __init__(self,
+                 max_pages: int = None,
+                 time_budget: float = None,
+                 target_toots: int = None,
+                 show: bool = True,
+                 refresh_interval: float = 0.5):
+        """
+        :param int max_pages: Maximum amount of pages fetched per instance. None for no limit.
+        :param float time_budget: Maximum duration of the fetch in seconds. None for no limit.
+        :param int target_toots: Fetch stops after this many toots passed the filters. None for no limit.
+        :param bool show: Print the progress line.
+        :param float refresh_interval: Minimal amount of seconds between two updates of the progress line.
+        """
+        self.max_pages = max_pages
+        self.time_budget = time_budget
+        self.target_toots = target_toots
+        self.show = show
+        self.refresh_interval = refresh_interval
+
+        self.pages: dict[str, int] = dict()
+        self.fetched = 0
+        self.kept = 0
+        self.start = time.time()
+        self._last_print = 0.0
+        self._finished = False
+
+    def elapsed(self) -> float:
+        return time.time() - self.start
+
+    def exhausted(self, domain: str) -> bool:
+        """
+        Returns true if no more pages should be fetched from the instance with the given domain.
+        """
+        if self.target_toots is not None and self.kept >= self.target_toots:
+            return True
+        if self.time_budget is not None and self.elapsed() >= self.time_budget:
+            return True
+        return self.max_pages is not None and self.pages.get(domain, 0) >= self.max_pages
+
+    def add_page(self, domain: str, fetched: int, kept: int) -> None:
+        """
+        :param str domain: Domain of the instance the page was fetched from.
+        :param int fetched: Amount of toots on the page.
+        :param int kept: Amount of toots on the page that passed the filters.
+        """
+        self.pages[domain] = self.pages.get(domain, 0) + 1
+        self.fetched += fetched
+        self.kept += kept
+        self.print_line()
+
+    def print_line(self, force: bool = False) -> None:
+        if not self.show or self._finished: return
+        now = time.time()
+        if not force and now - self._last_print < self.refresh_interval: return
+        self._last_print = now
+
+        elapsed = max(self.elapsed(), 0.001)
+        pages = sum(self.pages.values())
+        # The line is written to stderr and cleared before every redraw, so it does not mix with other output.
+        print("\r\x1b[K", round(elapsed, 1), "s | instances: ", len(self.pages), " | pages: ", pages,
+              " | fetched: ", self.fetched, " | kept: ", self.kept,
+              " | ", round(pages / elapsed, 2), " pages/s | ", round(self.kept / elapsed, 1), " toots/s",
+              sep="", end="", flush=True, file=sys.stderr)
+
+    def finish(self) -> None:
+        """
+        Prints the progress line a last time and ends it. Further calls do nothing.
+        """
+        if not self.show or self._finished: return
+        self._finished = True
+        self.print_line(force=True)
+        print(file=sys.stderr)
@@ -11,3 +11,9 @@ class FetchTimeStats:
             if stat['toot_count'] == 0 or stat['fetch_time'] == 0: continue
             print("Average fetch time:",
                   str(round(stat['fetch_time'] / (stat['toot_count'] / 40), 5)).ljust(8, '0'), "on", stat['domain'])
+
+    def print_summary(self):
+        for stat in sorted(self.stats, key=lambda s: s['toot_count'], reverse=True):
+            print(str(stat['toot_count']).rjust(10), "toots in", str(round(stat['fetch_time'], 1)).rjust(8), "s on",
+                  stat['domain'])
+        print("Total:", sum(stat['toot_count'] for stat in self.stats), "toots on", len(self.stats), "instances.")
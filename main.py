@@ -1,18 +1,130 @@
+import argparse
 import asyncio
+import sys
 
+from fetch_progress import FetchProgress
 from fetch_time_stats import FetchTimeStats
 from mastodb import MastodonDB
 
 
-def main():
-    masto_db = MastodonDB()
-    masto_db.mongo_handler.drop_all_collections()
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0: raise argparse.ArgumentTypeError("must be a positive integer, got " + value)
+    return number
+
+
+def positive_float(value: str) -> float:
+    number = float(value)
+    if not number > 0: raise argparse.ArgumentTypeError("must be a positive number, got " + value)
+    return number
+
+
+def discover(masto_db: MastodonDB, args: argparse.Namespace) -> None:
+    asyncio.run(masto_db.fetch_instances(args.api_token, dry_run=args.dry_run))
+
+
+def register(masto_db: MastodonDB, args: argparse.Namespace) -> None:
+    asyncio.run(masto_db.add_instances(args.domains, dry_run=args.dry_run))
+
+
+def crawl(masto_db: MastodonDB, args: argparse.Namespace) -> None:
+    progress = FetchProgress(args.max_pages, args.time_budget, args.target_toots, show=not args.verbose)
+    follow = args.command == "follow"
+    try:
+        asyncio.run(masto_db.fetch_posts(
+            concurrency=args.concurrency,
+            progress=progress,
+            dry_run=args.dry_run,
+            backfill_only=not follow,
+            follow=follow,
+            poll_interval=args.poll_interval if follow else 60,
+            domains=args.domains,
+            verbose=args.verbose,
+        ))
+    except KeyboardInterrupt:
+        print("Closed Program")
+
+
+def stats(masto_db: MastodonDB, args: argparse.Namespace) -> None:
+    fetch_time_stats = FetchTimeStats(masto_db.get_times())
+    fetch_time_stats.print_summary()
+    if args.average: fetch_time_stats.print_average()
+
 
-    #stats = FetchTimeStats(masto_db.get_times())
-    #stats.print_average()
+def export(masto_db: MastodonDB, args: argparse.Namespace) -> None:
+    if args.output == "-":
+        count = masto_db.export_toots(sys.stdout, args.domains, args.limit)
+    else:
+        with open(args.output, "w") as file:
+            count = masto_db.export_toots(file, args.domains, args.limit)
+    print("Exported ", count, " toots.", sep="", file=sys.stderr)
 
-    asyncio.run(masto_db.fetch_instances())
-    asyncio.run(masto_db.fetch_posts())
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Stores toots of mastodon instances in a MongoDB database.")
+    parser.add_argument("--dbconfig", default="config/dbconfig.json", help="Location of the database config.")
+    parser.add_argument("--toot-filter", default="search/toot_filter.json", help="Location of the toot filter.")
+    parser.add_argument("--toot-attributes", default="search/toot_attributes.json",
+                        help="Location of the toot attributes.")
+    parser.add_argument("--instance-filter", default="search/instance_filter.json",
+                        help="Location of the instance filter.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    discover_parser = subparsers.add_parser("discover", help="Add instances found with the instances.social API.")
+    discover_parser.add_argument("--api-token", default="config/api_token.json",
+                                 help="Location of the instances.social API token.")
+    discover_parser.add_argument("--dry-run", action="store_true", help="Only print the instances that would be added.")
+    discover_parser.set_defaults(run=discover)
+
+    register_parser = subparsers.add_parser("register", help="Add the instances with the given domains.")
+    register_parser.add_argument("domains", nargs="+", help="Domains of the instances. E.g. mastodon.social.")
+    register_parser.add_argument("--dry-run", action="store_true", help="Only print the instances that would be added.")
+    register_parser.set_defaults(run=register)
+
+    crawl_parser = argparse.ArgumentParser(add_help=False)
+    crawl_parser.add_argument("-c", "--concurrency", type=positive_int, default=None,
+                              help="Maximum amount of pages fetched at the same time.")
+    crawl_parser.add_argument("-p", "--max-pages", type=positive_int, default=None,
+                              help="Maximum amount of pages (40 toots) fetched per instance.")
+    crawl_parser.add_argument("-t", "--time-budget", type=positive_float, default=None,
+                              help="Stop after the given amount of seconds.")
+    crawl_parser.add_argument("-n", "--target-toots", type=positive_int, default=None,
+                              help="Stop after the given amount of toots passed the filters.")
+    crawl_parser.add_argument("-d", "--domain", dest="domains", action="append", default=None,
+                              help="Only fetch from this instance. Can be given multiple times.")
+    crawl_parser.add_argument("--dry-run", action="store_true",
+                              help="Fetch and filter toots without writing to the database. Useful for benchmarks.")
+    crawl_parser.add_argument("-v", "--verbose", action="store_true",
+                              help="Print every fetched page instead of the progress line.")
+
+    backfill_parser = subparsers.add_parser("backfill", parents=[crawl_parser],
+                                            help="Fetch older toots of instances that have not caught up yet.")
+    backfill_parser.set_defaults(run=crawl)
+
+    follow_parser = subparsers.add_parser("follow", parents=[crawl_parser],
+                                          help="Keep fetching new toots of all instances.")
+    follow_parser.add_argument("--poll-interval", type=positive_float, default=60,
+                               help="Seconds to wait before polling an instance again.")
+    follow_parser.set_defaults(run=crawl)
+
+    stats_parser = subparsers.add_parser("stats", help="Print the amount of stored toots and fetch durations.")
+    stats_parser.add_argument("--average", action="store_true", help="Also print the average fetch time per page.")
+    stats_parser.set_defaults(run=stats)
+
+    export_parser = subparsers.add_parser("export", help="Export stored toots as json lines.")
+    export_parser.add_argument("-o", "--output", default="toots.jsonl", help="Output file. Use - for stdout.")
+    export_parser.add_argument("-d", "--domain", dest="domains", action="append", default=None,
+                               help="Only export toots of this instance. Can be given multiple times.")
+    export_parser.add_argument("--limit", type=int, default=None, help="Maximum amount of toots per instance.")
+    export_parser.set_defaults(run=export)
+
+    return parser
+
+
+def main():
+    args = create_parser().parse_args()
+    masto_db = MastodonDB(args.dbconfig, args.toot_filter, args.toot_attributes, args.instance_filter)
+    args.run(masto_db, args)
 
 
 if __name__ == '__main__':
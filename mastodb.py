@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import ssl
 
 import aiohttp
@@ -6,9 +7,8 @@ import json
 import time
 
 import requests
-import traceback
 
-from typing import TypedDict
+from typing import TypedDict, TextIO
 
 from aiohttp import ClientTimeout, TooManyRedirects, ServerDisconnectedError, ClientSession, ClientResponse, \
     ClientOSError, ClientConnectorError
@@ -16,6 +16,7 @@ from pymongo.errors import DuplicateKeyError, OperationFailure, BulkWriteError
 from requests import Response
 
 from fetch_options import TootFilter, InstanceFilter, TootAttributes
+from fetch_progress import FetchProgress
 from mongo_handler import MongoHandler
 from datetime import datetime as dt
 from dateutil.parser import parse as date_parser
@@ -149,11 +150,12 @@ class MastodonDB:
                 result[domain] = task_result
         return result
 
-    async def add_instances(self, domains: list[str], instances: dict[str, dict] = None) -> None:
+    async def add_instances(self, domains: list[str], instances: dict[str, dict] = None, dry_run: bool = False) -> None:
         """
        Fetches info about the instances with the given domains and stores them in the database together with one toot.
        :param list[str] domains: Domains of the mastodon instances. E.g. ['mastodon.social'].
        :param dict[str, dict] instances: Optional, dict[domain] with info of the instance if already available.
+       :param bool dry_run: Only print the instances that would be added.
        :return None:
        """
         if "instanceData" in domains: domains.remove("instanceData")
@@ -162,6 +164,11 @@ class MastodonDB:
         if instances is None:
             instances = await self._fetch_domain_dict(domains, self._fetch_instance_info)
 
+        if dry_run:
+            for domain in toot_dict:
+                if domain in instances: print("Would create collection for instance:", domain)
+            return
+
         # TODO: Do all inserts at the same time.
         with self.db.client.start_session() as session:
             for domain, toot in toot_dict.items():
@@ -170,6 +177,7 @@ class MastodonDB:
                     self.db["instanceData"].insert_one({
                         "_id": domain,
                         "languages": instances[domain]["languages"],
+                        "version": instances[domain].get("version"),
                         "caughtUp": False,
                         "fetchTime": 0,
                     }, session=session)
@@ -234,21 +242,28 @@ class MastodonDB:
                 continue
         return result
 
-    async def _handle_fetch_batch_status(self, domain, res) -> bool | None:
-        if "x-ratelimit-remaining" not in res.headers: return False
+    def _handle_fetch_batch_status(self, domain, res) -> tuple[bool, float]:
+        """
+        Prints info about the status of a fetched page.
+        :return: True if status is ok and the seconds to wait before the next fetch if the ratelimit is reached.
+        """
+        if "x-ratelimit-remaining" not in res.headers:
+            print("Response has no ratelimit header:", domain)
+            return False, 0
         if res.status == 429:
             reset_timestamp = dt.timestamp(date_parser(res.headers["x-ratelimit-reset"]))
             delta = abs(reset_timestamp - dt.timestamp(dt.now()))
             print("Too many requests ", domain, " waiting for ", round(delta), "s.", sep="")
-            await sleep(delta + 1)
-            return None
+            return False, delta + 1
         else:
-            return self._handle_res_status(domain, res.status, res.reason)
+            return self._handle_res_status(domain, res.status, res.reason), 0
 
-    async def _get_batch(self, session: ClientSession, domain: str, params: dict) -> ClientResponse | None:
+    async def _get_batch(self, session: ClientSession, domain: str, path: str, params: dict) -> ClientResponse | None:
+        # List values are sent as repeated params, e.g. any[]=a&any[]=b.
+        query = [(key, value) for key, values in params.items()
+                 for value in (values if isinstance(values, list) else [values])]
         try:
-            return await session.get("https://" + domain + "/api/v1/timelines/public", params=params,
-                                     timeout=ClientTimeout(total=10))
+            return await session.get("https://" + domain + path, params=query, timeout=ClientTimeout(total=10))
         except Exception as e:
             if isinstance(e, ClientOSError):
                 print("ClientOSError occurred:", domain)
@@ -267,70 +282,167 @@ class MastodonDB:
                 raise
             return
 
-    async def _fetch_batch(self, instance: tuple[str, tuple[bool, str, str]], session: ClientSession) -> None:
+    async def _get_instance_version(self, session: ClientSession, domain: str, dry_run: bool) -> str | None:
         """
-        Fetches toots from all the instances in the database in an asynchronous fetch-loop.
-        :param instance: Date of the instances for the fetch-loop: domain, (caught_up, new_id, old_id).
-        :return:
+        Returns the version of the instance. It is stored in instanceData, so it is only fetched once.
+        Returns None if an error occurs.
         """
-        # Possible Speedup: Extract as many posts as possible and only put in DB if waiting time starts.
-        param_options = self.toot_filter.params()
-        domain, (caught_up, new_id, old_id) = instance
+        instance_data = self.db["instanceData"].find_one({"_id": domain}, {"version": 1})
+        if instance_data is not None and instance_data.get("version") is not None:
+            return instance_data["version"]
 
-        while True:
-            params = param_options | ({"min_id": new_id} if caught_up else {"max_id": old_id})
+        try:
+            async with await session.get("https://" + domain + "/api/v1/instance",
+                                         timeout=ClientTimeout(total=10)) as res:
+                if not self._handle_res_status(domain, res.status, res.reason): return None
+                version = (await res.json()).get("version")
+        except Exception:
+            print("Could not fetch instance info:", domain)
+            return None
 
-            fetch_start = time.time()
-            res = await self._get_batch(session, domain, params)
-            fetch_time = time.time() - fetch_start
+        if version is not None and not dry_run:
+            self.db["instanceData"].update_one({"_id": domain}, {"$set": {"version": version}})
+        return version
 
-            if res is None: return
-            status_ok = await self._handle_fetch_batch_status(domain, res)
-            if status_ok is None: return
-            if not status_ok: continue
+    async def _fetch_page(self, session: ClientSession, domain: str, path: str, params: dict,
+                          progress: FetchProgress, dry_run: bool, verbose: bool) -> list[dict] | float | None:
+        """
+        Fetches one page of toots and stores the toots that pass the filters.
+        :return: All toots of the page, the seconds to wait if the ratelimit is reached or None if an error occurred.
+        """
+        fetch_start = time.time()
+        res = await self._get_batch(session, domain, path, params)
+        fetch_time = time.time() - fetch_start
+
+        if res is None: return
+        status_ok, wait = self._handle_fetch_batch_status(domain, res)
+        if wait > 0:
+            res.release()
+            return float(wait)
+        # Instances with errors are dropped from the fetch-loop.
+        if not status_ok:
+            res.release()
+            return
+        if verbose:
             print("Remaining fetches: ", res.headers["x-ratelimit-remaining"], ", ", res.request_info.url, sep="")
 
-            toots = []
-            try:
-                toots_data: list[dict] = await res.json()
-            except asyncio.TimeoutError:
-                print("Json not parsable: ", domain)
-                continue
-            for toot in self.toot_filter.filter(toots_data):
-                if toot is dict(): return
-                toots.append(self.toot_attributes.create_toot_doc(toot))
-            if len(toots) == 0: continue
+        try:
+            toots_data: list[dict] = await res.json()
+        except asyncio.TimeoutError:
+            print("Json not parsable: ", domain)
+            res.release()
+            return
+        toots = [self.toot_attributes.create_toot_doc(toot) for toot in self.toot_filter.filter(toots_data)]
+        toots = [toot for toot in toots if toot != dict()]
+        progress.add_page(domain, len(toots_data), len(toots))
 
+        if len(toots) > 0 and not dry_run:
             try:
                 self.db[domain].insert_many(toots)
+                self.times[domain] = self.times.setdefault(domain, 0) + fetch_time  # Needs to be done after adding the toots.
             except BulkWriteError:
                 print("Duplicate key error: ", domain)
+        return toots_data
+
+    async def _fetch_batch(self, instance: tuple[str, tuple[bool, str, str]], session: ClientSession,
+                           progress: FetchProgress, dry_run: bool = False, follow: bool = False,
+                           poll_interval: float = 60, verbose: bool = True,
+                           semaphore: asyncio.Semaphore | contextlib.nullcontext = None) -> None:
+        """
+        Fetches toots from all the instances in the database in an asynchronous fetch-loop.
+        :param instance: Date of the instances for the fetch-loop: domain, (caught_up, new_id, old_id).
+        :param FetchProgress progress: Counts the fetched toots and decides when the budgets are exhausted.
+        :param bool dry_run: Toots are fetched and filtered, but nothing is written to the database.
+        :param bool follow: Only newer toots are fetched. Instead of stopping at the newest toot, the instance is
+            polled again after poll_interval seconds.
+        :param float poll_interval: Seconds to wait between two polls if follow is set.
+        :param bool verbose: Print the remaining fetches after every page.
+        :param semaphore: Limits the amount of pages fetched at the same time. None for no limit.
+        :return:
+        """
+        if semaphore is None: semaphore = contextlib.nullcontext()
+        # Possible Speedup: Extract as many posts as possible and only put in DB if waiting time starts.
+        domain, (caught_up, new_id, old_id) = instance
+        instance_info = dict()
+        if self.toot_filter.tags_any or self.toot_filter.tags_all:
+            async with semaphore:
+                instance_info = {"version": await self._get_instance_version(session, domain, dry_run)}
+        path, param_options = self.toot_filter.plan(instance_info)
+        if verbose: print("Fetching ", path, " from ", domain, ".", sep="")
+        if follow: caught_up = True
+
+        while not progress.exhausted(domain):
+            params = param_options | ({"min_id": new_id} if caught_up else {"max_id": old_id})
+            async with semaphore:
+                toots_data = await self._fetch_page(session, domain, path, params, progress, dry_run, verbose)
+            if toots_data is None: return
+            # The ratelimit is reached. Wait without blocking a fetch slot and fetch the same page again.
+            if isinstance(toots_data, float):
+                await sleep(toots_data)
                 continue
-            self.times[domain] = self.times.setdefault(domain, 0) + fetch_time  # Needs to be done after adding the toots.
-            new_id = max(*toots, {"_id": new_id}, key=self.cmp_toot_id)["_id"]
-            old_id = min(*toots, {"_id": old_id}, key=self.cmp_toot_id)["_id"]
-
-            # We reached the newest post, we also have caught up with the oldest. No more posts to get.
-            if len(toots_data) < 40 and caught_up: return
-            # We caught up with the oldest post. Only posts newer than the newest post in DB will be fetched now.
-            elif len(toots_data) < 40 and not caught_up:
-                self.db["instanceData"].update_one({"_id": domain}, {"$set": {"caughtUp": True}})
+
+            # The ids of all fetched toots move the cursor, otherwise a page without matching toots is fetched again.
+            page_ids = [{"_id": toot["id"]} for toot in toots_data if type(toot["id"]) == str]
+            if len(page_ids) > 0:
+                new_id = max(*page_ids, {"_id": new_id}, key=self.cmp_toot_id)["_id"]
+                old_id = min(*page_ids, {"_id": old_id}, key=self.cmp_toot_id)["_id"]
+
+            if len(toots_data) >= 40: continue
+            if not follow:
+                # We reached the newest post, we also have caught up with the oldest. No more posts to get.
+                if caught_up: return
+                # We caught up with the oldest post. Only posts newer than the newest post in DB will be fetched now.
+                # The end of a tag timeline says nothing about the public timeline of the instance.
+                if not dry_run and path == TootFilter.public_timeline:
+                    self.db["instanceData"].update_one({"_id": domain}, {"$set": {"caughtUp": True}})
                 return
 
-    async def fetch_posts(self) -> None:
+            # We reached the newest post. Wait for new posts without blocking a fetch slot.
+            await sleep(poll_interval)
+
+    async def fetch_posts(self,
+                          concurrency: int = None,
+                          progress: FetchProgress = None,
+                          dry_run: bool = False,
+                          backfill_only: bool = False,
+                          follow: bool = False,
+                          poll_interval: float = 60,
+                          domains: list[str] = None,
+                          verbose: bool = True) -> None:
         """
         Fetches toots from instances stored in the given database and stores them in it. Press CTRL+C to stop.
+        :param int concurrency: Maximum amount of pages fetched at the same time. None for no limit.
+        :param FetchProgress progress: Budgets of the fetch and progress output. Default: no budgets.
+        :param bool dry_run: Toots are fetched and filtered, but nothing is written to the database.
+        :param bool backfill_only: Only instances that have not caught up with their oldest toot are fetched.
+        :param bool follow: Fetch only newer toots and keep polling the instances for new ones.
+        :param float poll_interval: Seconds to wait between two polls if follow is set.
+        :param list[str] domains: Only fetch from these instances. None for all instances in the database.
+        :param bool verbose: Print the remaining fetches after every page.
         :return None:
         """
+        if progress is None: progress = FetchProgress(show=not verbose)
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else contextlib.nullcontext()
+
+        instances = self._get_instance_dict()
+        if domains is not None:
+            instances = {domain: data for domain, data in instances.items() if domain in domains}
+        if backfill_only:
+            instances = {domain: data for domain, data in instances.items() if not data[0]}
+        print("Fetching toots from ", len(instances), " instances.", sep="")
+
         try:
             async with aiohttp.ClientSession() as session:
-                x = [self._fetch_batch(entry, session) for entry in self._get_instance_dict().items()]
-                print(len(x))
-                await asyncio.gather(*x)
-                raise SystemExit("Closed Program")
-        except:
-            self._add_times()
-            traceback.print_exc()
+                fetches = [self._fetch_batch(entry, session, progress, dry_run, follow, poll_interval, verbose,
+                                             semaphore) for entry in instances.items()]
+                await asyncio.wait_for(asyncio.gather(*fetches), timeout=progress.time_budget)
+        except TimeoutError:
+            progress.finish()
+            print("Time budget exhausted.")
+        finally:
+            progress.finish()
+            if not dry_run: self._add_times()
+            self.times = dict()
 
     def _get_domains_and_instances(self, res: Response) -> tuple[list[str], dict[str, dict]]:
         domains = []
@@ -344,10 +456,11 @@ class MastodonDB:
             }
         return domains, instances
 
-    async def fetch_instances(self, api_token_link: str = "config/api_token.json") -> None:
+    async def fetch_instances(self, api_token_link: str = "config/api_token.json", dry_run: bool = False) -> None:
         """
         Fetches instances from the instances.social API which are than added to the database.
         :param str api_token_link: API token which can be created on https://instances.social/api/token.
+        :param bool dry_run: Only print the instances that would be added.
         :return None:
         """
         if api_token_link == "":
@@ -366,4 +479,24 @@ class MastodonDB:
         if not status_ok: return
 
         domains, instances = self._get_domains_and_instances(res)
-        await self.add_instances(domains, instances)
+        await self.add_instances(domains, instances, dry_run)
+
+    def export_toots(self, file: TextIO, domains: list[str] = None, limit: int = None) -> int:
+        """
+        Writes the stored toots as json lines into the given file. Every line contains the toot and its instance.
+        :param TextIO file: Opened file the toots are written to.
+        :param list[str] domains: Only export toots of these instances. None for all instances in the database.
+        :param int limit: Maximum amount of toots per instance. None for no limit.
+        :return int: Amount of exported toots.
+        """
+        if domains is None:
+            domains = [instance["_id"] for instance in self.db["instanceData"].find({}, {"_id": 1})]
+
+        count = 0
+        for domain in domains:
+            cursor = self.db[domain].find()
+            if limit is not None: cursor = cursor.limit(limit)
+            for toot in cursor:
+                file.write(json.dumps({"instance": domain} | toot, default=str) + "\n")
+                count += 1
+        return count
@@ -1,3 +1,5 @@
+import sys
+
 from utils import get_json
 from pymongo import MongoClient
 
@@ -22,7 +24,7 @@ class MongoHandler:
         )
         self.db = self.client[dbconfig["database"]]
         print("Connected to ", dbconfig["host"], ", ", dbconfig["port"],
-              ". Using database ", dbconfig["database"], ".", sep="")
+              ". Using database ", dbconfig["database"], ".", sep="", file=sys.stderr)
 
         if "instanceInfo" not in self.db.list_collection_names():
             self.db.create_collection("instanceInfo")